@@ -1,12 +1,32 @@
 import os
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, render_template
+import copy
+import hashlib
+import math
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache, wraps
+from apscheduler.schedulers.background import BackgroundScheduler
+from flask import Flask, request, render_template
+from flask_compress import Compress
+import numpy as np
+import orjson
 import requests
+import redis
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
 load_dotenv()
 
 app = Flask(__name__)
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIN_SIZE'] = 500
+Compress(app)
 
 API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
 API_URL = os.getenv('ALPHA_VANTAGE_BASE_URL')
@@ -15,6 +35,114 @@ PORT = int(os.getenv('PORT'))
 if not API_KEY:
     raise ValueError("Alpha Vantage API key not found")
 
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+redis_pool = redis.ConnectionPool.from_url(REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+cache = redis.Redis(connection_pool=redis_pool)
+
+# Cache TTLs in seconds: quotes and daily series refresh quickly, weekly bars
+# barely move
+CACHE_TTL = {
+    'GLOBAL_QUOTE': 60,
+    'TIME_SERIES_DAILY': 60,
+    'TIME_SERIES_WEEKLY': 6 * 60 * 60
+}
+ERROR_CACHE_TTL = 30
+
+# How long an expired entry may still be served while the API is unavailable
+STALE_TTL = 24 * 60 * 60
+
+# Daily pre-warm of the most requested symbols. Each symbol costs one call per
+# series function, so the default top N fits the daily API quota.
+DAILY_API_QUOTA = int(os.getenv('ALPHA_VANTAGE_DAILY_QUOTA', 25))
+POPULAR_SYMBOLS_KEY = 'popular_symbols'
+PREWARM_FUNCTIONS = {
+    'TIME_SERIES_DAILY': ('1W', '1M'),
+    'TIME_SERIES_WEEKLY': ('6M',)
+}
+PREWARM_TOP_N = int(os.getenv('PREWARM_TOP_N', DAILY_API_QUOTA // len(PREWARM_FUNCTIONS)))
+PREWARM_DELAY = 2
+# Pre-warmed entries stay fresh until the next daily run
+PREWARM_FRESH_TTL = 24 * 60 * 60
+PREWARM_LOCK_KEY = 'prewarm:lock'
+
+# US tickers, optionally with a share class suffix (e.g. BRK.B)
+_SYMBOL_RE = re.compile(r'^[A-Z]{1,5}(?:\.[A-Z])?$')
+
+# Response layout for the two series functions we use
+TIME_SERIES_KEY = {
+    'TIME_SERIES_DAILY': 'Time Series (Daily)',
+    'TIME_SERIES_WEEKLY': 'Weekly Time Series'
+}
+CLOSE_FIELD = '4. close'
+
+RATE_LIMIT_MESSAGE = 'API rate limit exceeded. Please try again later.'
+
+# Chart ranges the API accepts; anything else would get its own cache key
+RANGE_TYPES = ('1W', '1M', '6M')
+
+# Range value for current quotes only, without the chart series
+QUOTE_RANGE = 'CURRENT'
+
+# Bulk quotes need a premium key; once refused, every worker skips them for a
+# day. The local copy covers Redis being unavailable.
+BULK_QUOTES_UNAVAILABLE_KEY = 'av:REALTIME_BULK_QUOTES:unavailable'
+BULK_QUOTES_RETRY_AFTER = 24 * 60 * 60
+_bulk_quotes_unavailable_until = 0
+
+# UTC midnight timestamps are whole days since the epoch
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+SECONDS_PER_DAY = 86400
+
+# In-process cache entries expire when the 5 minute bucket rolls over
+LOCAL_CACHE_BUCKET = 5 * 60
+
+MAX_COMPARE_SYMBOLS = 5
+
+# Shared pool so comparisons fetch every symbol concurrently. Sized so every
+# request thread of a gunicorn worker can run a full comparison at once.
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', int(os.getenv('GUNICORN_THREADS', 8)) * MAX_COMPARE_SYMBOLS))
+executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+
+# Keep-alive session so repeat fetches skip the TCP/TLS handshake
+session = requests.Session()
+session.headers.update({
+    'User-Agent': 'MarketLens/1.0',
+    'Connection': 'keep-alive',
+    'Accept-Encoding': 'gzip'
+})
+adapter = HTTPAdapter(pool_connections=10, pool_maxsize=FETCH_WORKERS, max_retries=Retry(total=0))
+session.mount('https://', adapter)
+
+# Query parameters shared by every Alpha Vantage call
+_BASE_PARAMS = {
+    'apikey': API_KEY,
+    'datatype': 'json'
+}
+_SERIES_PARAMS = {**_BASE_PARAMS, 'outputsize': 'compact'}
+
+REQUEST_TIMEOUT = 15
+MAX_RETRIES = 3
+RETRY_BACKOFF_CAP = 8
+
+# Upstream calls currently in progress, shared by concurrent callers. Followers
+# wait out the leader's worst case: every attempt timing out plus the longest
+# jittered backoff between attempts, with a little slack.
+_inflight = {}
+_inflight_lock = threading.Lock()
+INFLIGHT_TIMEOUT = MAX_RETRIES * REQUEST_TIMEOUT + (MAX_RETRIES - 1) * RETRY_BACKOFF_CAP * 1.5 + 5
+
+
+def ojson(obj, status=200):
+    # orjson-backed replacement for jsonify
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
+
+
+def etag_matches(etag):
+    # Flask-Compress suffixes the ETag of compressed bodies with the algorithm
+    candidates = [etag] + [f'{etag}:{algorithm}' for algorithm in app.config['COMPRESS_ALGORITHM']]
+    return any(request.if_none_match.contains_weak(tag) for tag in candidates)
+
 
 @app.route('/')
 def home():
@@ -28,20 +156,28 @@ def get_stock_data():
     range_type = request.args.get('range', '1M')
     
     if not symbol:
-        return jsonify({'error': 'Stock symbol is required'}), 400
+        return ojson({'error': 'Stock symbol is required'}, 400)
+    
+    if not _SYMBOL_RE.match(symbol):
+        return ojson({'error': f'Invalid symbol: {symbol}'}, 400)
+    
+    if range_type not in RANGE_TYPES:
+        return ojson({'error': f'Invalid range: {range_type}'}, 400)
     
     try:
         data = fetch_stock_data(symbol, range_type)
         if not data:
-            return jsonify({'error': f'No data available for {symbol}. Check if symbol is valid or try again later.'}), 400
+            return ojson({'error': f'No data available for {symbol}. Check if symbol is valid or try again later.'}, 400)
         
         if isinstance(data, dict) and 'error' in data:
             if data['error'] == 'rate_limit':
-                return jsonify({'error': data['message']}), 429
+                return ojson({'error': data['message']}, 429)
             elif data['error'] == 'invalid_symbol':
-                return jsonify({'error': data['message']}), 400
+                return ojson({'error': data['message']}, 400)
+        
+        record_symbol_request(symbol)
         
-        return jsonify({
+        body = orjson.dumps({
             'symbol': symbol,
             'dates': data['dates'],
             'prices': data['prices'],
@@ -50,37 +186,75 @@ def get_stock_data():
             'percent_change': data['percent_change']
         })
         
+        # Hash the body itself: the range cutoff moves daily even when the
+        # latest bar does not, e.g. over weekends
+        etag = hashlib.md5(body, usedforsecurity=False).hexdigest()
+        
+        if etag_matches(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(body, mimetype='application/json')
+        
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, max-age=300'
+        if data.get('stale'):
+            response.headers['X-Cache'] = 'stale'
+        return response
+        
     except requests.RequestException:
-        return jsonify({'error': 'Failed to fetch stock data'}), 500
+        return ojson({'error': 'Failed to fetch stock data'}, 500)
     except Exception:
-        return jsonify({'error': 'Something went wrong'}), 500
+        return ojson({'error': 'Something went wrong'}, 500)
 
 
 @app.route('/api/multiple_stocks', methods=['POST'])
 def get_multiple_stocks():
     # Compare multiple stocks on a single chart
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return ojson({'error': 'Request body must be a JSON object'}, 400)
+    
     symbols = data.get('symbols', [])
     range_type = data.get('range', '1M')
     
     if not symbols:
-        return jsonify({'error': 'No symbols provided'}), 400
+        return ojson({'error': 'No symbols provided'}, 400)
+    
+    if not isinstance(symbols, list) or not all(isinstance(symbol, str) for symbol in symbols):
+        return ojson({'error': 'Symbols must be a list of strings'}, 400)
+    
+    if len(symbols) > MAX_COMPARE_SYMBOLS:
+        return ojson({'error': f'Maximum {MAX_COMPARE_SYMBOLS} stocks can be compared'}, 400)
     
-    if len(symbols) > 5:
-        return jsonify({'error': 'Maximum 5 stocks can be compared'}), 400
+    symbols = [symbol.upper().strip() for symbol in symbols]
     
     unique_symbols = list(set(symbols))
     if len(unique_symbols) != len(symbols):
-        return jsonify({'error': 'Duplicate symbols are not allowed'}), 400
+        return ojson({'error': 'Duplicate symbols are not allowed'}, 400)
+    
+    bad_symbols = [symbol for symbol in symbols if not _SYMBOL_RE.match(symbol)]
+    if bad_symbols:
+        return ojson({'error': f'Invalid symbols: {", ".join(bad_symbols)}'}, 400)
+    
+    if range_type != QUOTE_RANGE and range_type not in RANGE_TYPES:
+        return ojson({'error': f'Invalid range: {range_type}'}, 400)
+    
+    if range_type == QUOTE_RANGE:
+        return get_current_quotes(symbols)
     
     stocks_data = []
     invalid_symbols = []
     rate_limit_hit = False
+    stale = False
     
+    futures = {}
     for symbol in symbols:
+        futures[symbol] = executor.submit(fetch_stock_data, symbol, range_type)
+    
+    # Collect in request order so chart colours stay stable
+    for symbol, future in futures.items():
         try:
-            symbol = symbol.upper().strip()
-            stock_data = fetch_stock_data(symbol, range_type)
+            stock_data = future.result()
             
             if not stock_data:
                 continue
@@ -93,6 +267,8 @@ def get_multiple_stocks():
                     invalid_symbols.append(symbol)
                     continue
             
+            record_symbol_request(symbol)
+            stale = stale or stock_data.get('stale', False)
             stocks_data.append({
                 'symbol': symbol,
                 'dates': stock_data['dates'],
@@ -108,61 +284,366 @@ def get_multiple_stocks():
     response_data = {'stocks': stocks_data}
     
     if rate_limit_hit:
-        response_data['error'] = 'API rate limit exceeded. Please try again later.'
-        return jsonify(response_data), 429
+        response_data['error'] = RATE_LIMIT_MESSAGE
+        return ojson(response_data, 429)
     elif invalid_symbols:
         response_data['invalid_symbols'] = invalid_symbols
         response_data['message'] = f'Invalid symbols: {", ".join(invalid_symbols)}'
     
-    return jsonify(response_data)
+    response = ojson(response_data)
+    if stale:
+        response.headers['X-Cache'] = 'stale'
+    return response
 
 
-def fetch_stock_data(symbol, range_type):
-    # Fetch historical data 
-    try:
-        if range_type == '6M':
-            function = 'TIME_SERIES_WEEKLY'
-        else:
-            function = 'TIME_SERIES_DAILY'
+def get_current_quotes(symbols):
+    # Latest price and change only, without the chart series
+    quotes = fetch_current_quotes(symbols)
+    if not quotes:
+        return ojson({'error': 'Failed to fetch stock data'}, 500)
+    
+    if quotes.get('error') == 'rate_limit':
+        return ojson({'stocks': [], 'error': quotes['message']}, 429)
+    
+    stocks_data = []
+    invalid_symbols = []
+    rate_limit_hit = False
+    stale = False
+    
+    for symbol in symbols:
+        quote = quotes.get(symbol)
         
-        params = {
-            'function': function,
+        # None means the upstream call failed, not that the symbol is unknown
+        if not quote:
+            continue
+        if quote.get('error') == 'invalid_symbol':
+            invalid_symbols.append(symbol)
+            continue
+        if quote.get('error') == 'rate_limit':
+            rate_limit_hit = True
+            break
+        if 'error' in quote:
+            continue
+        
+        stale = stale or quote.get('stale', False)
+        stocks_data.append({
             'symbol': symbol,
-            'apikey': API_KEY,
-            'outputsize': 'compact',
-            'datatype': 'json'
-        }
+            'current_price': quote['current_price'],
+            'change': quote['change'],
+            'percent_change': quote['percent_change']
+        })
+    
+    response_data = {'stocks': stocks_data}
+    
+    if rate_limit_hit:
+        response_data['error'] = RATE_LIMIT_MESSAGE
+        return ojson(response_data, 429)
+    elif invalid_symbols:
+        response_data['invalid_symbols'] = invalid_symbols
+        response_data['message'] = f'Invalid symbols: {", ".join(invalid_symbols)}'
+    
+    response = ojson(response_data)
+    if stale:
+        response.headers['X-Cache'] = 'stale'
+    return response
+
+
+def get_api_function(range_type):
+    # Quotes for current prices, weekly bars for the long range, daily otherwise
+    if range_type == QUOTE_RANGE:
+        return 'GLOBAL_QUOTE'
+    if range_type == '6M':
+        return 'TIME_SERIES_WEEKLY'
+    return 'TIME_SERIES_DAILY'
+
+
+def _get_with_retry(url, params, max_retries=MAX_RETRIES):
+    # Back off on 429, honouring Retry-After when the API sends it
+    for attempt in range(max_retries):
+        response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+        if response.status_code != 429 or attempt == max_retries - 1:
+            return response
         
-        response = requests.get(API_URL, params=params, timeout=15)
+        wait = _parse_retry_after(response)
+        if wait is None:
+            wait = min(RETRY_BACKOFF_CAP, 2 ** attempt)
+        elif wait > RETRY_BACKOFF_CAP:
+            # Retrying before the server allows it only burns quota
+            return response
+        time.sleep(wait + random.uniform(0, 0.5 * wait))
+    
+    return response
+
+
+def _parse_retry_after(response):
+    # Retry-After in seconds, or None when missing, an HTTP date or nonsense
+    try:
+        wait = float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        return None
+    if not math.isfinite(wait) or wait < 0:
+        return None
+    return wait
+
+
+def parse_date(date_str):
+    # Slice ISO dates by hand; much cheaper than strptime
+    return date(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]))
+
+
+def check_api_error(data, symbol):
+    # Map Alpha Vantage error payloads to our error results
+    if 'Error Message' in data:
+        return {'error': 'invalid_symbol', 'message': f'Invalid symbol: {symbol}'}
+    if 'Note' in data:
+        return {'error': 'rate_limit', 'message': RATE_LIMIT_MESSAGE}
+    if 'Information' in data and 'rate limit' in data['Information'].lower():
+        return {'error': 'rate_limit', 'message': RATE_LIMIT_MESSAGE}
+    return None
+
+
+def parse_close(entry):
+    # Closing price of a series entry, NaN when missing or malformed
+    try:
+        return float(entry[CLOSE_FIELD])
+    except (KeyError, TypeError, ValueError):
+        return np.nan
+
+
+def cached(ttl, error_ttl=ERROR_CACHE_TTL, stale_ttl=STALE_TTL):
+    # Cache fetch results in Redis, keyed by series function, symbol and range.
+    # Entries outlive their TTL by stale_ttl so an expired copy can be served
+    # while it is refreshed in the background, or while the API is failing.
+    def decorator(func):
+        def store(key, result, fresh_ttl, keep_ttl):
+            now = time.time()
+            try:
+                pipe = cache.pipeline()
+                pipe.delete(key)
+                pipe.hset(key, mapping={
+                    'body': orjson.dumps(result),
+                    'fresh_until': now + fresh_ttl,
+                    'stale_until': now + keep_ttl
+                })
+                pipe.expire(key, int(keep_ttl) + 1)
+                pipe.execute()
+            except redis.RedisError:
+                pass
         
-        if response.status_code != 200:
-            return None
+        def revalidate(key, symbol, range_type, function):
+            result = func(symbol, range_type)
+            if result and 'error' not in result:
+                store(key, result, ttl[function], ttl[function] + stale_ttl)
+                return
             
-        data = response.json()
+            # Upstream still failing; keep serving the stale copy for longer
+            try:
+                pipe = cache.pipeline()
+                pipe.hset(key, 'stale_until', time.time() + stale_ttl)
+                pipe.expire(key, stale_ttl + 1)
+                pipe.execute()
+            except redis.RedisError:
+                pass
         
-        if 'Error Message' in data:
-            return {'error': 'invalid_symbol', 'message': f'Invalid symbol: {symbol}'}
-        if 'Note' in data:
-            return {'error': 'rate_limit', 'message': 'API rate limit exceeded. Please try again later.'}
-        if 'Information' in data and 'rate limit' in data['Information'].lower():
-            return {'error': 'rate_limit', 'message': 'API rate limit exceeded. Please try again later.'}
-        
-        time_series_key = None
-        for key in data.keys():
-            if 'Time Series' in key:
-                time_series_key = key
-                break
-        
-        if not time_series_key or not data.get(time_series_key):
+        @wraps(func)
+        def wrapper(symbol, range_type):
+            function = get_api_function(range_type)
+            key = f'av:{function}:{symbol}:{range_type}'
+            
+            try:
+                entry = cache.hgetall(key)
+            except redis.RedisError:
+                entry = None
+            
+            # A refresh can extend an entry that expired meanwhile, leaving no body
+            if entry and b'body' in entry:
+                now = time.time()
+                body = orjson.loads(entry[b'body'])
+                if now < float(entry[b'fresh_until']):
+                    return body
+                if now < float(entry[b'stale_until']):
+                    # Only one refresh per key at a time, across all workers
+                    try:
+                        refreshing = cache.set(f'{key}:refresh', 1, nx=True, ex=error_ttl)
+                    except redis.RedisError:
+                        refreshing = False
+                    if refreshing:
+                        threading.Thread(
+                            target=revalidate,
+                            args=(key, symbol, range_type, function),
+                            daemon=True
+                        ).start()
+                    body['stale'] = True
+                    return body
+            
+            result = func(symbol, range_type)
+            
+            # Rate limit and invalid symbol responses are cached briefly so we
+            # stop hammering the API after a 429
+            if result:
+                if 'error' in result:
+                    store(key, result, error_ttl, error_ttl)
+                else:
+                    store(key, result, ttl[function], ttl[function] + stale_ttl)
+            
+            return result
+        
+        def peek(symbol, range_type):
+            # Fresh cached result, or None; never calls upstream
+            function = get_api_function(range_type)
+            key = f'av:{function}:{symbol}:{range_type}'
+            try:
+                entry = cache.hgetall(key)
+            except redis.RedisError:
+                return None
+            if entry and b'body' in entry and time.time() < float(entry[b'fresh_until']):
+                return orjson.loads(entry[b'body'])
             return None
         
-        time_series = data[time_series_key]
+        def prime(symbol, range_type, result, fresh_ttl=None):
+            # Store a result fetched elsewhere, e.g. by the pre-warm job
+            function = get_api_function(range_type)
+            key = f'av:{function}:{symbol}:{range_type}'
+            fresh_ttl = fresh_ttl or ttl[function]
+            store(key, result, fresh_ttl, fresh_ttl + stale_ttl)
         
-        dates = []
-        prices = []
+        wrapper.peek = peek
+        wrapper.prime = prime
+        return wrapper
+    return decorator
+
+
+def single_flight(func):
+    # Let concurrent callers for the same symbol and range share one upstream call
+    @wraps(func)
+    def wrapper(symbol, range_type):
+        key = (symbol, range_type)
+        with _inflight_lock:
+            future = _inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                _inflight[key] = future
+        
+        if not leader:
+            return future.result(timeout=INFLIGHT_TIMEOUT)
+        
+        try:
+            result = func(symbol, range_type)
+            future.set_result(result)
+            return result
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+    return wrapper
+
+
+def record_symbol_request(symbol):
+    # Track symbol popularity for the daily pre-warm
+    try:
+        cache.zincrby(POPULAR_SYMBOLS_KEY, 1, symbol)
+    except redis.RedisError:
+        pass
+
+
+def refresh_top_symbols():
+    # Pre-fetch the most requested symbols so user requests hit the cache.
+    # Every worker process schedules this job; only the first one runs it.
+    try:
+        if not cache.set(PREWARM_LOCK_KEY, 1, nx=True, ex=60 * 60):
+            return
+        symbols = cache.zrevrange(POPULAR_SYMBOLS_KEY, 0, PREWARM_TOP_N - 1)
+    except redis.RedisError:
+        return
+    
+    for symbol in symbols:
+        symbol = symbol.decode()
+        for function, range_types in PREWARM_FUNCTIONS.items():
+            try:
+                time_series = _fetch_time_series(symbol, function)
+            except Exception:
+                time_series = None
+            if time_series and time_series.get('error') == 'rate_limit':
+                return
+            
+            # One upstream call fills every range served by this function
+            if time_series and 'error' not in time_series:
+                for range_type in range_types:
+                    result = build_price_series(time_series, range_type)
+                    if result:
+                        _fetch_historical_data.prime(symbol, range_type, result, PREWARM_FRESH_TTL)
+            
+            # Space out calls to stay under the free tier throttle
+            time.sleep(PREWARM_DELAY)
+
+
+class _Uncacheable(Exception):
+    # Carries a result that must not be kept by lru_cache
+    def __init__(self, result):
+        super().__init__()
+        self.result = result
+
+
+def fetch_stock_data(symbol, range_type):
+    # Fetch historical data, served from cache when possible
+    bucket = int(time.time() // LOCAL_CACHE_BUCKET)
+    try:
+        return copy.copy(_cached_fetch(symbol, range_type, bucket))
+    except _Uncacheable as exc:
+        return exc.result
+
+
+@lru_cache(maxsize=512)
+def _cached_fetch(symbol, range_type, bucket):
+    # Keep parsed results in memory; errors, misses and stale copies go back
+    # through Redis
+    result = _fetch_historical_data(symbol, range_type)
+    if not result or 'error' in result or result.get('stale'):
+        raise _Uncacheable(result)
+    return result
+
+
+@cached(ttl=CACHE_TTL)
+@single_flight
+def _fetch_historical_data(symbol, range_type):
+    # Fetch historical data from Alpha Vantage
+    try:
+        time_series = _fetch_time_series(symbol, get_api_function(range_type))
+        if not time_series or 'error' in time_series:
+            return time_series
         
-        sorted_dates = sorted(time_series.keys())
+        return build_price_series(time_series, range_type)
+        
+    except Exception:
+        return None
+
+
+def _fetch_time_series(symbol, function):
+    # Raw date -> bar mapping for one series function, or an error result
+    params = {**_SERIES_PARAMS, 'function': function, 'symbol': symbol}
+    
+    response = _get_with_retry(API_URL, params)
+    
+    if response.status_code == 429:
+        return {'error': 'rate_limit', 'message': RATE_LIMIT_MESSAGE}
+    if response.status_code != 200:
+        return None
         
+    data = orjson.loads(response.content)
+    
+    api_error = check_api_error(data, symbol)
+    if api_error:
+        return api_error
+    
+    return data.get(TIME_SERIES_KEY[function])
+
+
+def build_price_series(time_series, range_type):
+    # Cut a raw series down to the requested range and compute its stats
+    try:
         today = datetime.now().date()
         
         if range_type == '1W':
@@ -186,40 +667,30 @@ def fetch_stock_data(symbol, range_type):
             else:
                 cutoff_date = today.replace(month=today.month-1)
 
-        filtered_dates = []
-        for date_str in sorted_dates:
-            try:
-                date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-                if date_obj >= cutoff_date:
-                    filtered_dates.append(date_str)
-            except ValueError:
-                continue
-
-        sorted_dates = filtered_dates
+        # Alpha Vantage returns newest first; flip to ascending instead of sorting
+        # and jump to the cutoff, since ISO dates compare lexicographically
+        sorted_dates = list(time_series.keys())
+        if sorted_dates and sorted_dates[0] > sorted_dates[-1]:
+            sorted_dates.reverse()
+        sorted_dates = sorted_dates[bisect_left(sorted_dates, cutoff_date.isoformat()):]
         
-        if not sorted_dates:
-            return None
+        count = len(sorted_dates)
+        closes = np.fromiter((parse_close(time_series[d]) for d in sorted_dates), dtype=np.float64, count=count)
+        ordinals = np.fromiter((parse_date(d).toordinal() for d in sorted_dates), dtype=np.int64, count=count)
+        timestamps = (ordinals - EPOCH_ORDINAL) * SECONDS_PER_DAY
         
-        for date_str in sorted_dates:
-            date_data = time_series[date_str]
-            
-            try:
-                date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                timestamp = int(date_obj.timestamp())
-                dates.append(timestamp)
-                
-                close_price = float(date_data.get('4. close', 0))
-                prices.append(round(close_price, 2))
-                
-            except (ValueError, KeyError):
-                pass
+        valid = ~np.isnan(closes)
         
-        if not dates:
+        if not valid.any():
             return None
         
-        current_price = prices[-1] if prices else 0
+        # Python's round() is correctly rounded; np.round turns e.g. 100.025
+        # into 100.02
+        dates = timestamps[valid].tolist()
+        prices = [round(price, 2) for price in closes[valid].tolist()]
+        current_price = prices[-1]
         
-        if len(prices) >= 2:
+        if len(prices) >= 2 and prices[0]:
             period_start_price = prices[0]
             change = round(current_price - period_start_price, 2)
             percent_change = round((change / period_start_price) * 100, 2)
@@ -239,5 +710,129 @@ def fetch_stock_data(symbol, range_type):
         return None
 
 
+def fetch_current_quotes(symbols):
+    # Latest quotes for all symbols, from cache where possible. Symbols not
+    # cached yet are fetched in one bulk call when the key allows it.
+    missing = [symbol for symbol in symbols if _fetch_quote.peek(symbol, QUOTE_RANGE) is None]
+    quotes = {}
+    
+    if len(missing) > 1 and bulk_quotes_available():
+        bulk = _fetch_bulk_quotes(missing)
+        if bulk and bulk.get('error') == 'rate_limit':
+            return bulk
+        for symbol in missing:
+            if bulk and symbol in bulk:
+                quotes[symbol] = bulk[symbol]
+                _fetch_quote.prime(symbol, QUOTE_RANGE, bulk[symbol])
+    
+    remaining = [symbol for symbol in symbols if symbol not in quotes]
+    quotes.update(zip(remaining, executor.map(lambda symbol: _fetch_quote(symbol, QUOTE_RANGE), remaining)))
+    return quotes
+
+
+def bulk_quotes_available():
+    # False once the bulk endpoint has refused our key
+    try:
+        return not cache.exists(BULK_QUOTES_UNAVAILABLE_KEY)
+    except redis.RedisError:
+        return time.time() >= _bulk_quotes_unavailable_until
+
+
+def mark_bulk_quotes_unavailable():
+    # Skip bulk quotes for a day, in every worker
+    global _bulk_quotes_unavailable_until
+    _bulk_quotes_unavailable_until = time.time() + BULK_QUOTES_RETRY_AFTER
+    try:
+        cache.set(BULK_QUOTES_UNAVAILABLE_KEY, 1, ex=BULK_QUOTES_RETRY_AFTER)
+    except redis.RedisError:
+        pass
+
+
+def _fetch_bulk_quotes(symbols):
+    # Fetch latest quotes for several symbols in one REALTIME_BULK_QUOTES call
+    try:
+        params = {**_BASE_PARAMS, 'function': 'REALTIME_BULK_QUOTES', 'symbol': ','.join(symbols)}
+        
+        response = _get_with_retry(API_URL, params)
+        
+        if response.status_code == 429:
+            return {'error': 'rate_limit', 'message': RATE_LIMIT_MESSAGE}
+        if response.status_code != 200:
+            return None
+        
+        data = orjson.loads(response.content)
+        
+        api_error = check_api_error(data, ','.join(symbols))
+        if api_error and api_error['error'] == 'rate_limit':
+            return api_error
+        
+        if not isinstance(data.get('data'), list):
+            mark_bulk_quotes_unavailable()
+            return None
+        
+        quotes = {}
+        for entry in data['data']:
+            try:
+                current_price = round(float(entry['close']), 2)
+                previous_close = float(entry['previous_close'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            
+            change = round(current_price - previous_close, 2)
+            percent_change = round((change / previous_close) * 100, 2) if previous_close else 0
+            quotes[str(entry.get('symbol', '')).upper()] = {
+                'current_price': current_price,
+                'change': change,
+                'percent_change': percent_change
+            }
+        
+        return quotes
+        
+    except Exception:
+        return None
+
+
+@cached(ttl=CACHE_TTL)
+@single_flight
+def _fetch_quote(symbol, range_type):
+    # Fetch the latest quote for a single symbol
+    try:
+        params = {**_BASE_PARAMS, 'function': 'GLOBAL_QUOTE', 'symbol': symbol}
+        
+        response = _get_with_retry(API_URL, params)
+        
+        if response.status_code == 429:
+            return {'error': 'rate_limit', 'message': RATE_LIMIT_MESSAGE}
+        if response.status_code != 200:
+            return None
+        
+        data = orjson.loads(response.content)
+        
+        api_error = check_api_error(data, symbol)
+        if api_error:
+            return api_error
+        
+        # Unknown symbols come back as an empty quote
+        quote = data.get('Global Quote')
+        if not quote:
+            return {'error': 'invalid_symbol', 'message': f'Invalid symbol: {symbol}'}
+        
+        return {
+            'current_price': round(float(quote['05. price']), 2),
+            'change': round(float(quote['09. change']), 2),
+            'percent_change': round(float(quote['10. change percent'].rstrip('%')), 2)
+        }
+        
+    except Exception:
+        return None
+
+
+# Run after US market close, at a random minute so deployments don't all
+# hit the API at once
+scheduler = BackgroundScheduler(daemon=True)
+scheduler.add_job(refresh_top_symbols, 'cron', hour=21, minute=random.randint(0, 59), timezone='UTC')
+scheduler.start()
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=PORT)
\ No newline at end of file
@@ -58,7 +58,8 @@ function formatPrice(price) {
 function formatDate(timestamp) {
     return new Date(timestamp * 1000).toLocaleDateString('en-US', {
         month: 'short',
-        day: 'numeric'
+        day: 'numeric',
+        timeZone: 'UTC'
     });
 }
 